@@ -1,36 +1,334 @@
 #!/usr/bin/env -S pipx run
 # /// script
 # requires-python = ">=3.11"
-# dependencies = ["click >= 7.0", "ghreq ~= 0.1", "ghtoken ~= 0.1"]
+# dependencies = [
+#    "click >= 7.0",
+#    "ghtoken ~= 0.1",
+#    "httpx[http2] ~= 0.27",
+#    "orjson ~= 3.0",
+# ]
 # ///
 
 from __future__ import annotations
-from collections.abc import Iterator
+import asyncio
+from collections.abc import AsyncIterator
 from datetime import datetime, timedelta, timezone
+import json
+from operator import itemgetter
+import os
+from pathlib import Path
+import tempfile
+import time
+from types import TracebackType
+from typing import Any
 import click
-import ghreq
 from ghtoken import GHTokenNotFound, get_ghtoken
+import httpx
+import orjson
 
 WINDOW = timedelta(days=3)
 
+# Maximum number of repositories to fetch workflow runs for at once
+CONCURRENCY = 10
 
-class Client(ghreq.Client):
-    def get_repos(self, owner: str | None) -> Iterator[dict]:
+# Maximum number of pages of a single listing to fetch at once
+PAGE_CONCURRENCY = 5
+
+# Maximum number of times to retry a request that failed with a server error
+# or was rate limited
+RETRIES = 5
+
+# Base & maximum number of seconds to wait between retries of a request
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+
+# Responses to repository listings are cached here along with their ETags so
+# that unchanged listings can be fetched with conditional requests
+ETAG_CACHE = Path.home() / ".cache" / "ghscripts" / "active-etags.json"
+
+
+class Client:
+    def __init__(self, token: str) -> None:
+        self.http = httpx.AsyncClient(
+            base_url="https://api.github.com",
+            headers={
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {token}",
+                "X-GitHub-Api-Version": "2022-11-28",
+            },
+            follow_redirects=True,
+            timeout=30.0,
+            transport=httpx.AsyncHTTPTransport(http2=True),
+        )
+        self.etags: dict[str, dict[str, Any]] = load_etags()
+        # Only the entries used in this run are saved, so that pages of
+        # listings that are no longer fetched get dropped
+        self.used_etags: dict[str, dict[str, Any]] = {}
+
+    async def __aenter__(self) -> Client:
+        return self
+
+    async def __aexit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        await self.http.aclose()
+        # Don't throw away the entries for the pages that a failed run didn't
+        # get to
+        if _exc_type is None and self.used_etags != self.etags:
+            save_etags(self.used_etags)
+
+    async def get_page(
+        self,
+        url: str,
+        params: dict[str, Any] | None,
+        cached: bool,
+        conditional: bool = True,
+    ) -> tuple[Any, dict[str, str], bool]:
+        # Returns the decoded body, a mapping from Link header rels to URLs,
+        # and whether the response was fresh rather than served from the
+        # cache.  If `cached` is true, the response is cached, and (unless
+        # `conditional` is false) the request is conditional on the ETag of
+        # the page from a previous run, with a 304 being served from the
+        # cache.
+        req = self.http.build_request("GET", url, params=params)
+        key = str(req.url)
+        entry = self.etags.get(key) if cached and conditional else None
+        if entry is not None:
+            req.headers["If-None-Match"] = entry["etag"]
+        r = await self.send(req)
+        if r.status_code == 304 and entry is not None:
+            self.used_etags[key] = entry
+            return entry["body"], entry["links"], False
+        data = orjson.loads(r.content)
+        links = {rel: link["url"] for rel, link in r.links.items() if rel is not None}
+        if cached and (etag := r.headers.get("ETag")) is not None:
+            self.used_etags[key] = {"etag": etag, "body": data, "links": links}
+        return data, links, True
+
+    async def refresh_links(
+        self, url: str, params: dict[str, Any] | None
+    ) -> dict[str, str]:
+        # An ETag only covers a page's body, not its Link header, so the cached
+        # links of what used to be the last page can't be trusted to say that
+        # no pages have been added after it.  Re-request it unconditionally to
+        # find out.
+        _, links, _ = await self.get_page(url, params, True, conditional=False)
+        return links
+
+    async def send(self, req: httpx.Request) -> httpx.Response:
+        # Like ghreq, retry server errors, rate limits, and network errors with
+        # exponential backoff, and raise a PrettyHTTPError for any other 4xx or
+        # 5xx response
+        attempt = 0
+        while True:
+            try:
+                r = await self.http.send(req)
+            except httpx.TransportError:
+                if attempt >= RETRIES:
+                    raise
+                delay = backoff(attempt)
+            else:
+                d = retry_delay(r, attempt) if attempt < RETRIES else None
+                if d is None:
+                    if r.is_error:
+                        raise PrettyHTTPError(r)
+                    return r
+                delay = d
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def paginate(
+        self, path: str, params: dict[str, Any] | None = None, cached: bool = False
+    ) -> AsyncIterator[dict]:
+        data, links, fresh = await self.get_page(path, params, cached)
+        for it in page_items(path, data):
+            yield it
+        if "next" not in links and not fresh:
+            links = await self.refresh_links(path, params)
+        if "next" not in links:
+            return
+        nexturl: str | None = links["next"]
+        last = httpx.URL(links.get("last", ""))
+        if fresh and (lastpage := last.params.get("page", "")).isdigit():
+            # The Link header tells us how many pages there are, so fetch all
+            # of the rest at once.  (A cached Link header may be out of date,
+            # so this is only done when the first page is fresh.)
+            sem = asyncio.Semaphore(PAGE_CONCURRENCY)
+            urls = [
+                str(last.copy_set_param("page", p)) for p in range(2, int(lastpage) + 1)
+            ]
+
+            async def fetch(url: str) -> tuple[Any, dict[str, str], bool]:
+                async with sem:
+                    return await self.get_page(url, None, cached)
+
+            pages = await asyncio.gather(*map(fetch, urls))
+            for url, (data, _, _) in zip(urls, pages):
+                for it in page_items(url, data):
+                    yield it
+            # Pages may have been added since the first page was fetched, so
+            # keep following the last page's links
+            _, links, fresh = pages[-1]
+            if "next" not in links and not fresh:
+                links = await self.refresh_links(urls[-1], None)
+            nexturl = links.get("next")
+        while nexturl is not None:
+            data, links, fresh = await self.get_page(nexturl, None, cached)
+            for it in page_items(nexturl, data):
+                yield it
+            if "next" not in links and not fresh:
+                links = await self.refresh_links(nexturl, None)
+            nexturl = links.get("next")
+
+    def get_repos(self, owner: str | None) -> AsyncIterator[dict]:
         if owner is None:
-            return self.paginate("/user/repos", params={"affiliation": "owner"})
+            return self.paginate(
+                "/user/repos",
+                params={"affiliation": "owner", "per_page": 100},
+                cached=True,
+            )
         else:
-            return self.paginate(f"/users/{owner}/repos")
-
-    def get_runs(self, repo: str, created_after: datetime) -> Iterator[dict]:
-        # This omits queued runs:
-        # return self.paginate(
-        #     f"/repos/{repo}/actions/runs",
-        #     params={"created": ">" + created_after.isoformat(timespec="seconds")},
-        # )
-        for run in self.paginate(f"/repos/{repo}/actions/runs"):
-            if datetime.fromisoformat(run["created_at"]) <= created_after:
+            return self.paginate(
+                f"/users/{owner}/repos", params={"per_page": 100}, cached=True
+            )
+
+    async def get_runs(self, repo: str, created_after: datetime) -> list[dict]:
+        # The API's timestamps are all in this format, so they can be compared
+        # as strings without parsing them.
+        cutoff = created_after.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        # Filtering by `created` omits queued runs, so those are fetched
+        # separately and merged in.
+        runs: dict[int, dict] = {}
+        async for run in self.paginate(
+            f"/repos/{repo}/actions/runs",
+            params={"created": ">" + cutoff, "per_page": 100},
+        ):
+            runs[run["id"]] = run
+        async for run in self.paginate(
+            f"/repos/{repo}/actions/runs",
+            params={"status": "queued", "per_page": 100},
+        ):
+            if run["created_at"] <= cutoff:
                 break
-            yield run
+            runs.setdefault(run["id"], run)
+        return sorted(runs.values(), key=itemgetter("created_at"), reverse=True)
+
+
+async def get_active_runs(
+    token: str,
+    owner: str | None,
+    include_forks: bool,
+    include_private: bool,
+    created_after: datetime,
+) -> list[tuple[str, list[dict]]]:
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with Client(token) as client:
+
+        async def runs_for(repo: str) -> list[dict]:
+            async with sem:
+                runs = await client.get_runs(repo, created_after)
+            return [run for run in runs if run["status"] != "completed"]
+
+        repos = [
+            repo["full_name"]
+            async for repo in client.get_repos(owner)
+            if not repo["archived"]
+            and (include_forks or not repo["fork"])
+            and (include_private or not repo["private"])
+        ]
+        # `gather()` returns results in the order of its arguments, so the
+        # output is in the same order as the repository listing.
+        running = await asyncio.gather(*map(runs_for, repos))
+    return list(zip(repos, running))
+
+
+class PrettyHTTPError(httpx.HTTPStatusError):
+    def __init__(self, response: httpx.Response) -> None:
+        super().__init__(
+            f"{response.status_code} error for URL: {response.url}",
+            request=response.request,
+            response=response,
+        )
+
+    def __str__(self) -> str:
+        r = self.response
+        kind = "Client" if r.is_client_error else "Server"
+        msg = f"{r.status_code} {kind} Error: {r.reason_phrase} for URL: {r.url}"
+        if r.text.strip():
+            try:
+                body = r.json()
+            except ValueError:
+                msg += "\n\n" + r.text
+            else:
+                msg += "\n\n" + json.dumps(body, indent=4)
+        return msg
+
+
+def backoff(attempt: int) -> float:
+    return float(min(BACKOFF_BASE * 2**attempt, BACKOFF_MAX))
+
+
+def retry_delay(r: httpx.Response, attempt: int) -> float | None:
+    # Returns how many seconds to wait before retrying the request that
+    # received `r`, or `None` if it should not be retried
+    if r.status_code >= 500:
+        return backoff(attempt)
+    elif r.status_code in (403, 429):
+        if (after := r.headers.get("Retry-After", "")).isdigit():
+            delay = int(after) + 1
+        elif (
+            r.headers.get("x-ratelimit-remaining") == "0"
+            and (reset := r.headers.get("x-ratelimit-reset", "")).isdigit()
+        ):
+            delay = int(reset) - int(time.time()) + 1
+        elif r.status_code == 429 or "rate limit" in r.text:
+            # Secondary rate limit without any indication of when it lifts
+            delay = 0
+        else:
+            # Plain "forbidden"
+            return None
+        if delay > BACKOFF_MAX:
+            # Not worth waiting for
+            return None
+        return max(delay, backoff(attempt))
+    else:
+        return None
+
+
+def page_items(url: str, data: Any) -> list[dict]:
+    if isinstance(data, list):
+        return data
+    itemses = [v for v in data.values() if isinstance(v, list)]
+    if len(itemses) != 1:
+        raise ValueError(f"Unique list field not found in {url} response")
+    return itemses[0]
+
+
+def load_etags() -> dict[str, dict[str, Any]]:
+    try:
+        with ETAG_CACHE.open(encoding="utf-8") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_etags(etags: dict[str, dict[str, Any]]) -> None:
+    ETAG_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    # Repository listings can run to megabytes, so write them to a temporary
+    # file and then move it into place, lest a concurrent or interrupted run
+    # see a truncated cache
+    fd, tmp = tempfile.mkstemp(dir=ETAG_CACHE.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            json.dump(etags, fp)
+        os.replace(tmp, ETAG_CACHE)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
 
 @click.command(context_settings={"help_option_names": ["-h", "--help"]})
@@ -61,47 +359,40 @@ def main(owner: str | None, include_forks: bool, include_private: bool) -> None:
             " or hub.oauthtoken."
         )
     created_after = datetime.now(timezone.utc) - WINDOW
-    with Client(token=token) as client:
-        first = True
-        for repo in client.get_repos(owner):
-            if repo["archived"]:
-                continue
-            if repo["fork"] and not include_forks:
-                continue
-            if repo["private"] and not include_private:
-                continue
-            running = [
-                run
-                for run in client.get_runs(repo["full_name"], created_after)
-                if run["status"] != "completed"
-            ]
-            if running:
-                if first:
-                    first = False
-                else:
-                    print()
-                header = repo["full_name"]
-                print(header)
-                print("-" * len(header))
-                for run in running:
-                    s = "{name} #{run_number}".format_map(run)
-                    if (attempt := run["run_attempt"]) is not None and attempt > 1:
-                        s += f"(attempt {attempt})"
-                    if run["display_title"] != run["name"]:
-                        s += f" - {run['display_title']}"
-                    event = run["event"]
-                    if event == "pull_request":
-                        event = "PR"
-                    s += f" - {event}"
-                    if run["pull_requests"]:
-                        s += " " + ", ".join(
-                            "#{number}".format_map(pr) for pr in run["pull_requests"]
-                        )
-                    if branch := run["head_branch"]:
-                        s += f" - {branch}"
-                    created_at = datetime.fromisoformat(run["created_at"]).astimezone()
-                    s += f" - {run['status']} - {created_at}"
-                    print(s)
+    results = asyncio.run(
+        get_active_runs(token, owner, include_forks, include_private, created_after)
+    )
+    first = True
+    for repo, running in results:
+        if running:
+            if first:
+                first = False
+            else:
+                print()
+            print(repo)
+            print("-" * len(repo))
+            for run in running:
+                print(format_run(run))
+
+
+def format_run(run: dict) -> str:
+    attempt = run["run_attempt"]
+    attempt_str = f"(attempt {attempt})" if attempt is not None and attempt > 1 else ""
+    if run["display_title"] != run["name"]:
+        title = f" - {run['display_title']}"
+    else:
+        title = ""
+    event = "PR" if run["event"] == "pull_request" else run["event"]
+    if prs := run["pull_requests"]:
+        prs_str = " " + ", ".join(f"#{pr['number']}" for pr in prs)
+    else:
+        prs_str = ""
+    branch = f" - {br}" if (br := run["head_branch"]) else ""
+    created_at = datetime.fromisoformat(run["created_at"]).astimezone()
+    return (
+        f"{run['name']} #{run['run_number']}{attempt_str}{title} - {event}{prs_str}"
+        f"{branch} - {run['status']} - {created_at}"
+    )
 
 
 if __name__ == "__main__":
@@ -5,21 +5,25 @@
 #    "click ~= 8.0",
 #    "ghtoken ~= 0.1",
 #    "ghreq ~= 0.6",
+#    "orjson ~= 3.0",
 #    "python-dateutil ~= 2.9",
 #    "txtble ~= 0.12",
 # ]
 # ///
 
 from __future__ import annotations
+from array import array
 from collections.abc import Iterator
 from dataclasses import dataclass, field
 from datetime import date, datetime, time, timedelta, tzinfo
 import json
+from pathlib import Path
 from typing import Any
 import click
 from dateutil.tz import gettz
 import ghreq
 from ghtoken import get_ghtoken
+import orjson
 from txtble import Txtble
 
 __author__ = "John Thorvald Wodder II"
@@ -29,61 +33,100 @@ __url__ = "https://github.com/jwodder/ghscripts"
 
 REPO_QTY_GUESS = 10
 
-QUERY = """
-query ($from: DateTime!, $to: DateTime!, $maxRepositories: Int!) {
-    viewer {
-        contributionsCollection (from: $from, to: $to) {
+# Maximum number of days to query in a single request; larger queries risk
+# hitting GitHub's GraphQL timeouts & resource limits
+DAYS_PER_QUERY = 30
+
+DAY_START = time(0, 0, 0)
+DAY_END = time(23, 59, 59)
+
+# The largest number of repositories contributed to in a single day seen so
+# far is stored here and used to improve on REPO_QTY_GUESS, so that days rarely
+# need to be re-queried
+GUESS_CACHE = Path.home() / ".cache" / "ghscripts" / "contribs_guess.json"
+
+QUERY_TEMPLATE = """
+query ({params}) {{
+    viewer {{
+{fields}    }}
+}}
+"""
+
+FIELD_TEMPLATE = """\
+        d{i}: contributionsCollection (from: $from{i}, to: $to{i}) {{
             totalRepositoriesWithContributedCommits
-            commitContributionsByRepository (maxRepositories: $maxRepositories) {
-                repository {
+            commitContributionsByRepository (maxRepositories: $maxRepos{i}) {{
+                repository {{
                     nameWithOwner
-                }
-                contributions {
+                }}
+                contributions {{
                     totalCount
-                }
-            }
-        }
-    }
-}
+                }}
+            }}
+        }}
 """
 
 
 class Client(ghreq.Client):
     def query(self, query: str, variables: dict[str, Any]) -> dict:
-        data = self.graphql(query, variables)
+        # orjson decodes the raw bytes faster than `Response.json()` does.
+        data = orjson.loads(self.graphql(query, variables, raw=True).content)
         if err := data.get("errors"):
             raise GraphQLException(err)
         return data["data"]  # type: ignore[no-any-return]
 
-    def get_contributions(self, from_dt: datetime, to_dt: datetime) -> dict[str, int]:
-        # Note: Batching the requests doesn't speed things up.  I tried.
-        data = self.query(
-            QUERY,
-            {
-                "from": from_dt.isoformat(),
-                "to": to_dt.isoformat(),
-                "maxRepositories": REPO_QTY_GUESS,
-            },
+    def get_contributions_range(
+        self, windows: list[tuple[datetime, datetime]]
+    ) -> list[dict[str, int]]:
+        if not windows:
+            return []
+        # The windows are fetched DAYS_PER_QUERY at a time by giving each one
+        # its own alias in the query.
+        cached_guess = load_guess()
+        guess = max(REPO_QTY_GUESS, cached_guess)
+        colls = self.query_contributions(
+            [(from_dt, to_dt, guess) for from_dt, to_dt in windows]
         )
-        real_qty = data["viewer"]["contributionsCollection"][
-            "totalRepositoriesWithContributedCommits"
+        qtys = [c["totalRepositoriesWithContributedCommits"] for c in colls]
+        redo = [i for i, qty in enumerate(qtys) if qty > guess]
+        if redo:
+            fixed = self.query_contributions([(*windows[i], qtys[i]) for i in redo])
+            for i, c in zip(redo, fixed):
+                colls[i] = c
+        if max(qtys) > cached_guess:
+            save_guess(max(qtys))
+        return [
+            {
+                ccbr["repository"]["nameWithOwner"]: ccbr["contributions"]["totalCount"]
+                for ccbr in c["commitContributionsByRepository"]
+            }
+            for c in colls
         ]
-        assert isinstance(real_qty, int)
-        if real_qty > REPO_QTY_GUESS:
-            data = self.query(
-                QUERY,
-                {
-                    "from": from_dt.isoformat(),
-                    "to": to_dt.isoformat(),
-                    "maxRepositories": real_qty,
-                },
-            )
-        return {
-            ccbr["repository"]["nameWithOwner"]: ccbr["contributions"]["totalCount"]
-            for ccbr in data["viewer"]["contributionsCollection"][
-                "commitContributionsByRepository"
-            ]
-        }
+
+    def query_contributions(
+        self, windows: list[tuple[datetime, datetime, int]]
+    ) -> list[dict[str, Any]]:
+        colls: list[dict[str, Any]] = []
+        for start in range(0, len(windows), DAYS_PER_QUERY):
+            batch = windows[start : start + DAYS_PER_QUERY]
+            colls.extend(self.query_contributions_batch(batch))
+        return colls
+
+    def query_contributions_batch(
+        self, windows: list[tuple[datetime, datetime, int]]
+    ) -> list[dict[str, Any]]:
+        params = []
+        fields = []
+        variables: dict[str, Any] = {}
+        for i, (from_dt, to_dt, max_repos) in enumerate(windows):
+            params.append(f"$from{i}: DateTime!, $to{i}: DateTime!, $maxRepos{i}: Int!")
+            fields.append(FIELD_TEMPLATE.format(i=i))
+            variables[f"from{i}"] = from_dt.isoformat()
+            variables[f"to{i}"] = to_dt.isoformat()
+            variables[f"maxRepos{i}"] = max_repos
+        query = QUERY_TEMPLATE.format(params=", ".join(params), fields="".join(fields))
+        data = self.query(query, variables)["viewer"]
+        return [data[f"d{i}"] for i in range(len(windows))]
 
 
 class GraphQLException(Exception):
@@ -119,39 +162,47 @@ class GraphQLException(Exception):
 
 @dataclass
 class ContribTabulator:
-    contribs: dict[str, dict[date, int]] = field(init=False, default_factory=dict)
-    dates: set[date] = field(init=False, default_factory=set)
-    totals: dict[date, int] = field(init=False, default_factory=dict)
+    # Mapping from repository names to their row indices in `counts`
+    repos: dict[str, int] = field(init=False, default_factory=dict)
+    # counts[i][j] is the number of contributions to repository `i` on
+    # `dates[j]`.  Rows are stored as C int arrays to keep them compact over
+    # long date ranges.
+    counts: list[array[int]] = field(init=False, default_factory=list)
+    dates: list[date] = field(init=False, default_factory=list)
+    totals: list[int] = field(init=False, default_factory=list)
+    # row_totals[i] is the sum of counts[i]
+    row_totals: list[int] = field(init=False, default_factory=list)
+    grand_total: int = field(init=False, default=0)
 
     def add(self, d: date, contribs: dict[str, int]) -> None:
-        self.totals[d] = sum(contribs.values())
-        for repo, date2contribs in self.contribs.items():
-            date2contribs[d] = contribs.pop(repo, 0)
+        # Dates must be added in increasing order so that `dates` (and thus
+        # the columns of `counts`) stay sorted.
+        assert not self.dates or self.dates[-1] < d
+        self.dates.append(d)
+        total = sum(contribs.values())
+        self.totals.append(total)
+        self.grand_total += total
+        for repo, i in self.repos.items():
+            count = contribs.pop(repo, 0)
+            self.counts[i].append(count)
+            self.row_totals[i] += count
         for new_repo, count in contribs.items():
-            self.contribs[new_repo] = {d: count}
-            for old_date in self.dates:
-                self.contribs[new_repo][old_date] = 0
-        self.dates.add(d)
+            self.repos[new_repo] = len(self.counts)
+            row = array("i", [0]) * (len(self.dates) - 1)
+            row.append(count)
+            self.counts.append(row)
+            self.row_totals.append(count)
 
     def to_table(self) -> str:
-        dates = sorted(self.dates)
         tbl = Txtble(
-            headers=["Repository", *dates, "Total"],
+            headers=["Repository", *self.dates, "Total"],
             align=["l"],
             align_fill="r",
             padding=1,
         )
-        for repo, contribs in sorted(self.contribs.items()):
-            tbl.append(
-                [repo, *(contribs[d] or None for d in dates), sum(contribs.values())]
-            )
-        tbl.append(
-            [
-                "TOTAL",
-                *(self.totals[d] or None for d in dates),
-                sum(self.totals.values()),
-            ]
-        )
+        for repo, i in sorted(self.repos.items()):
+            tbl.append([repo, *(c or None for c in self.counts[i]), self.row_totals[i]])
+        tbl.append(["TOTAL", *(c or None for c in self.totals), self.grand_total])
         return tbl.show()
 
 
@@ -182,10 +233,13 @@ def main(days: int, highlight: bool) -> None:
     end_date = date.today()
     start_date = end_date - timedelta(days=days - 1)
     tbl = ContribTabulator()
+    dates = list(iterdates(start_date, end_date, tz))
     with Client(token=get_ghtoken()) as client:
-        for d, from_dt, to_dt in iterdates(start_date, end_date, tz):
-            contribs = client.get_contributions(from_dt, to_dt)
-            tbl.add(d, contribs)
+        contribs = client.get_contributions_range(
+            [(from_dt, to_dt) for _, from_dt, to_dt in dates]
+        )
+    for (d, _, _), c in zip(dates, contribs):
+        tbl.add(d, c)
     s = tbl.to_table()
     if highlight:
         lines = s.splitlines()
@@ -195,13 +249,32 @@ def main(days: int, highlight: bool) -> None:
     print(s)
 
 
+def load_guess() -> int:
+    # Returns 0 if there is no usable cached guess
+    try:
+        with GUESS_CACHE.open(encoding="utf-8") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return 0
+    if isinstance(data, dict):
+        guess = data.get("max_repos")
+        if isinstance(guess, int) and not isinstance(guess, bool):
+            return guess
+    return 0
+
+
+def save_guess(guess: int) -> None:
+    GUESS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    GUESS_CACHE.write_text(json.dumps({"max_repos": guess}), encoding="utf-8")
+
+
 def iterdates(
     start: date, end: date, tz: tzinfo
 ) -> Iterator[tuple[date, datetime, datetime]]:
     d = start
     while d <= end:
-        start_dt = datetime.combine(d, time(0, 0, 0), tz)
-        end_dt = datetime.combine(d, time(23, 59, 59), tz)
+        start_dt = datetime.combine(d, DAY_START, tz)
+        end_dt = datetime.combine(d, DAY_END, tz)
         yield (d, start_dt, end_dt)
         d += timedelta(days=1)
 
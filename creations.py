@@ -1,16 +1,18 @@
 #!/usr/bin/env -S pipx run
 # /// script
 # requires-python = ">=3.11"
-# dependencies = ["ghreq ~= 0.1", "ghtoken ~= 0.1"]
+# dependencies = ["ghreq ~= 0.6", "ghtoken ~= 0.1"]
 # ///
 
 from __future__ import annotations
 import argparse
-from collections.abc import Sequence
+from collections.abc import Iterator, Sequence
 from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime
+import json
 import textwrap
 from typing import Any
-from ghreq import Client
+import ghreq
 from ghtoken import get_ghtoken
 
 __author__ = "John Thorvald Wodder II"
@@ -19,6 +21,67 @@ __license__ = "MIT"
 __url__ = "https://github.com/jwodder/ghscripts"
 
 
+class Client(ghreq.Client):
+    def query(self, query: str, variables: dict[str, Any]) -> dict:
+        data = self.graphql(query, variables)
+        if err := data.get("errors"):
+            raise GraphQLException(err)
+        return data["data"]  # type: ignore[no-any-return]
+
+    def get_events(self, user: str, since: datetime) -> Iterator[dict]:
+        # If no events have happened since `since`, the API responds to this
+        # conditional request with a 304 (which doesn't count against the rate
+        # limit), and there's nothing to iterate over.
+        r = self.get(
+            f"/users/{user}/events",
+            params={"per_page": 100},
+            headers={
+                "If-Modified-Since": format_datetime(
+                    since.astimezone(timezone.utc), usegmt=True
+                )
+            },
+            raw=True,
+        )
+        if r.status_code == 304:
+            return
+        while True:
+            yield from r.json()
+            if (url := r.links.get("next", {}).get("url")) is None:
+                break
+            r = self.get(url, raw=True)
+
+
+class GraphQLException(Exception):
+    def __init__(self, errors: list[dict[str, Any]]) -> None:
+        self.errors = errors
+        super().__init__(errors)
+
+    def __str__(self) -> str:
+        try:
+            lines = []
+            if len(self.errors) == 1:
+                lines.append("GraphQL API error:")
+            else:
+                lines.append("GraphQL API errors:")
+            first = True
+            for e in self.errors:
+                if first:
+                    first = False
+                else:
+                    lines.append("---")
+                for k, v in e.items():
+                    k = k.title()
+                    if isinstance(v, str | int | bool):
+                        lines.append(f"{k}: {v}")
+                    else:
+                        lines.append(k + ": " + json.dumps(v, sort_keys=True))
+            return "\n".join(lines)
+        except Exception:
+            return "MALFORMED GRAPHQL ERROR:\n" + json.dumps(
+                self.errors, sort_keys=True, indent=True
+            )
+
+
 class DaysAgo(argparse.Action):
     def __call__(
         self,
@@ -70,10 +133,21 @@ def main() -> None:
     args = parser.parse_args()
     with Client(token=get_ghtoken()) as client:
         whoami = client.get("/user")["login"]
-        for ev in client.paginate(f"/users/{whoami}/events"):
-            created = datetime.fromisoformat(ev["created_at"])
-            if created < args.since:
+        events = []
+        for ev in client.get_events(whoami, args.since):
+            if datetime.fromisoformat(ev["created_at"]) < args.since:
                 break
+            events.append(ev)
+        prinfo = get_pr_info(
+            client,
+            [
+                (ev["repo"]["name"], ev["payload"]["pull_request"]["number"])
+                for ev in events
+                if is_shown_pr_event(ev)
+            ],
+        )
+        for ev in events:
+            created = datetime.fromisoformat(ev["created_at"])
             ts = created.astimezone().strftime("%Y-%m-%d %H:%M")
             repo = ev["repo"]["name"]
             action = ev["payload"].get("action")
@@ -88,11 +162,10 @@ def main() -> None:
                     title = ev["payload"]["issue"]["title"]
                     print(f"[{ts}] {action.title()} issue {repo}#{number}: {title}")
                 case ("PullRequestEvent", "opened" | "closed" | "reopened"):
-                    prdata = ev["payload"]["pull_request"]
-                    fullpr = client.get(prdata["url"])
+                    number = ev["payload"]["pull_request"]["number"]
+                    fullpr = prinfo[repo, number]
                     if action == "closed" and fullpr["merged"]:
                         action = "merged"
-                    number = prdata["number"]
                     title = fullpr["title"]
                     print(f"[{ts}] {action.title()} PR {repo}#{number}: {title}")
                 case ("ReleaseEvent", "published"):
@@ -103,5 +176,40 @@ def main() -> None:
                     pass
 
 
+def is_shown_pr_event(ev: dict[str, Any]) -> bool:
+    return ev["type"] == "PullRequestEvent" and ev["payload"].get("action") in (
+        "opened",
+        "closed",
+        "reopened",
+    )
+
+
+def get_pr_info(
+    client: Client, prs: list[tuple[str, int]]
+) -> dict[tuple[str, int], dict[str, Any]]:
+    # Fetches the titles & merged statuses of the given pull requests (each
+    # identified by a repository full name and PR number) in a single GraphQL
+    # request
+    keys = list(dict.fromkeys(prs))
+    if not keys:
+        return {}
+    params = []
+    fields = []
+    variables: dict[str, Any] = {}
+    for i, (repo, number) in enumerate(keys):
+        owner, _, name = repo.partition("/")
+        params.append(f"$owner{i}: String!, $name{i}: String!, $number{i}: Int!")
+        fields.append(
+            f"pr{i}: repository(owner: $owner{i}, name: $name{i})"
+            f" {{ pullRequest(number: $number{i}) {{ title merged }} }}"
+        )
+        variables[f"owner{i}"] = owner
+        variables[f"name{i}"] = name
+        variables[f"number{i}"] = number
+    query = "query (" + ", ".join(params) + ") {\n" + "\n".join(fields) + "\n}"
+    data = client.query(query, variables)
+    return {key: data[f"pr{i}"]["pullRequest"] for i, key in enumerate(keys)}
+
+
 if __name__ == "__main__":
     main()
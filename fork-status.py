@@ -1,29 +1,207 @@
 #!/usr/bin/env -S pipx run
 # /// script
-# requires-python = ">=3.8"
+# requires-python = ">=3.10"
 # dependencies = [
 #     "click >= 7.0",
 #     "ghrepo ~= 0.1",
+#     "ghreq ~= 0.6",
 #     "ghtoken ~= 0.1",
-#     "PyGithub ~= 2.0",
 # ]
 # ///
 
 from __future__ import annotations
 from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
+import json
 from operator import attrgetter
+from typing import Any
+from urllib.parse import quote
 import click
 from ghrepo import get_local_repo
+import ghreq
 from ghtoken import get_ghtoken
-from github import Auth, Github, GithubException
-from github.Repository import Repository
 
 __author__ = "John Thorvald Wodder II"
 __author_email__ = "ghscripts@varonathe.org"
 __license__ = "MIT"
 __url__ = "https://github.com/jwodder/ghscripts"
 
+# Maximum number of branches to query the API about at once
+MAX_WORKERS = 10
+
+# Maximum number of parent refs to look up per GraphQL request
+REF_BATCH_SIZE = 100
+
+FORK_QUERY = """
+query ($owner: String!, $name: String!, $cursor: String) {
+    repository (owner: $owner, name: $name) {
+        nameWithOwner
+        parent {
+            nameWithOwner
+            owner {
+                login
+            }
+            defaultBranchRef {
+                name
+                target {
+                    oid
+                }
+            }
+        }
+        refs (refPrefix: "refs/heads/", first: 100, after: $cursor) {
+            nodes {
+                name
+                target {
+                    oid
+                }
+                associatedPullRequests (
+                    first: 10,
+                    orderBy: {field: CREATED_AT, direction: DESC}
+                ) {
+                    nodes {
+                        number
+                        state
+                        baseRepository {
+                            nameWithOwner
+                        }
+                    }
+                }
+            }
+            pageInfo {
+                endCursor
+                hasNextPage
+            }
+        }
+    }
+}
+"""
+
+
+class Client(ghreq.Client):
+    def query(self, query: str, variables: dict[str, Any]) -> dict:
+        data = self.graphql(query, variables)
+        if err := data.get("errors"):
+            raise GraphQLException(err)
+        return data["data"]  # type: ignore[no-any-return]
+
+    def get_fork(self, repo: str) -> Fork | None:
+        # Returns `None` if the repository is not a fork
+        owner, _, name = repo.partition("/")
+        variables: dict[str, Any] = {"owner": owner, "name": name, "cursor": None}
+        branches: list[Branch] = []
+        while True:
+            data = self.query(FORK_QUERY, variables)["repository"]
+            if (parent := data["parent"]) is None:
+                return None
+            for node in data["refs"]["nodes"]:
+                # The branch's PR must be against the parent, not the fork
+                # itself
+                pr = next(
+                    (
+                        pr
+                        for pr in node["associatedPullRequests"]["nodes"]
+                        if pr["baseRepository"] is not None
+                        and pr["baseRepository"]["nameWithOwner"]
+                        == parent["nameWithOwner"]
+                    ),
+                    None,
+                )
+                branches.append(
+                    Branch(
+                        name=node["name"],
+                        oid=node["target"]["oid"],
+                        prnum=pr["number"] if pr is not None else None,
+                        prstatus=pr["state"].lower() if pr is not None else None,
+                    )
+                )
+            page_info = data["refs"]["pageInfo"]
+            if not page_info["hasNextPage"]:
+                break
+            variables["cursor"] = page_info["endCursor"]
+        return Fork(
+            full_name=data["nameWithOwner"],
+            parent=parent["nameWithOwner"],
+            parent_owner=parent["owner"]["login"],
+            default_branch=parent["defaultBranchRef"]["name"],
+            default_oid=parent["defaultBranchRef"]["target"]["oid"],
+            branches=sorted(branches, key=attrgetter("name")),
+        )
+
+    def get_head_oids(self, repo: str, branches: list[str]) -> dict[str, str]:
+        # Returns a mapping from those given branch names that exist in `repo`
+        # to the OIDs of their heads
+        owner, _, name = repo.partition("/")
+        heads: dict[str, str] = {}
+        for start in range(0, len(branches), REF_BATCH_SIZE):
+            batch = branches[start : start + REF_BATCH_SIZE]
+            params = ["$owner: String!", "$name: String!"]
+            fields = []
+            variables: dict[str, Any] = {"owner": owner, "name": name}
+            for i, br in enumerate(batch):
+                params.append(f"$ref{i}: String!")
+                fields.append(
+                    f"ref{i}: ref (qualifiedName: $ref{i}) {{ target {{ oid }} }}"
+                )
+                variables[f"ref{i}"] = f"refs/heads/{br}"
+            query = (
+                "query ("
+                + ", ".join(params)
+                + ") { repository (owner: $owner, name: $name) { "
+                + " ".join(fields)
+                + " } }"
+            )
+            data = self.query(query, variables)["repository"]
+            for i, br in enumerate(batch):
+                if (ref := data[f"ref{i}"]) is not None:
+                    heads[br] = ref["target"]["oid"]
+        return heads
+
+    def compare(self, repo: str, base: str, head: str) -> tuple[int, int] | None:
+        # Returns the numbers of commits by which `head` is ahead of & behind
+        # `base`, or `None` if the two are unrelated
+        try:
+            delta = self.get(f"/repos/{repo}/compare/{quote(base)}...{quote(head)}")
+        except ghreq.PrettyHTTPError as e:
+            if e.response.status_code == 404:
+                # No common ancester between branches (or other causes?)
+                return None
+            else:
+                raise
+        return (delta["ahead_by"], delta["behind_by"])
+
+
+class GraphQLException(Exception):
+    def __init__(self, errors: list[dict[str, Any]]) -> None:
+        self.errors = errors
+        super().__init__(errors)
+
+    def __str__(self) -> str:
+        try:
+            lines = []
+            if len(self.errors) == 1:
+                lines.append("GraphQL API error:")
+            else:
+                lines.append("GraphQL API errors:")
+            first = True
+            for e in self.errors:
+                if first:
+                    first = False
+                else:
+                    lines.append("---")
+                for k, v in e.items():
+                    k = k.title()
+                    if isinstance(v, str | int | bool):
+                        lines.append(f"{k}: {v}")
+                    else:
+                        lines.append(k + ": " + json.dumps(v, sort_keys=True))
+            return "\n".join(lines)
+        except Exception:
+            return "MALFORMED GRAPHQL ERROR:\n" + json.dumps(
+                self.errors, sort_keys=True, indent=True
+            )
+
 
 @click.command(context_settings={"help_option_names": ["-h", "--help"]})
 @click.option(
@@ -87,42 +265,65 @@ def main(
     the `gh` or `hub` command, or by setting the `hub.oauthtoken` Git config
     option in your `~/.gitconfig` file.
     """
-    gh = Github(auth=Auth.Token(get_ghtoken()))
-    repo_objs: Iterable[Repository]
-    if list_all:
-        repo_objs = filter(
-            attrgetter("fork"), gh.get_user().get_repos(affiliation="owner")
-        )
-    elif repo:
-        repo_objs = map(gh.get_repo, repo)
-    else:
-        repo_objs = [gh.get_repo(str(get_local_repo()))]
-    for i, r in enumerate(repo_objs):
-        if i:
-            print()
-        if not r.fork:
-            print(f"{r.full_name}: not a fork")
-            continue
-        header = f"{r.full_name} → {r.parent.full_name}"
-        print(header)
-        print("-" * len(header))
-        any_branches = False
-        for brstatus in get_branch_statuses(r):
-            if brstatus.is_even() and not all_branches:
-                continue
-            if pr_status is not None and pr_status != brstatus.prstatus:
-                continue
-            if has_pr is True and brstatus.prnum is None:
-                continue
-            if has_pr is False and brstatus.prnum is not None:
+    with Client(token=get_ghtoken()) as client:
+        repos: Iterable[str]
+        if list_all:
+            repos = (
+                r["full_name"]
+                for r in client.paginate(
+                    "/user/repos", params={"affiliation": "owner", "per_page": 100}
+                )
+                if r["fork"]
+            )
+        elif repo:
+            repos = repo
+        else:
+            repos = [str(get_local_repo())]
+        for i, r in enumerate(repos):
+            if i:
+                print()
+            fork = client.get_fork(r)
+            if fork is None:
+                print(f"{r}: not a fork")
                 continue
-            any_branches = True
-            print(brstatus.show())
-        if not any_branches:
-            print("-- nothing --")
+            header = f"{fork.full_name} → {fork.parent}"
+            print(header)
+            print("-" * len(header))
+            any_branches = False
+            for brstatus in get_branch_statuses(client, fork):
+                if brstatus.is_even() and not all_branches:
+                    continue
+                if pr_status is not None and pr_status != brstatus.prstatus:
+                    continue
+                if has_pr is True and brstatus.prnum is None:
+                    continue
+                if has_pr is False and brstatus.prnum is not None:
+                    continue
+                any_branches = True
+                print(brstatus.show())
+            if not any_branches:
+                print("-- nothing --")
 
 
 @dataclass
+class Fork:
+    full_name: str
+    parent: str
+    parent_owner: str
+    default_branch: str
+    default_oid: str
+    branches: list[Branch]
+
+
+@dataclass(frozen=True, slots=True)
+class Branch:
+    name: str
+    oid: str
+    prnum: int | None
+    prstatus: str | None
+
+
+@dataclass(frozen=True, slots=True)
 class BranchStatus:
     name: str
     on_parent: bool
@@ -162,60 +363,50 @@ class BranchStatus:
         return f"{plus} {self.name:32}  {self.ahead_behind():9}  {prnum:8}  {prstatus}"
 
 
-def get_branch_statuses(repo: Repository) -> Iterator[BranchStatus]:
-    for br in sorted(repo.get_branches(), key=attrgetter("name")):
-        try:
-            repo.parent.get_branch(br.name)
-        except GithubException as e:
-            if e.status == 404:
-                on_parent = False
-                cmpbranch = repo.parent.default_branch
-            else:
-                raise
-        else:
-            on_parent = True
-            cmpbranch = br.name
-        try:
-            delta = repo.compare(f"{repo.parent.owner.login}:{cmpbranch}", br.name)
-        except GithubException as e:
-            if e.status == 404:
-                # No common ancester between branches (or other causes?)
-                related = False
-                ahead = None
-                behind = None
-            else:
-                raise
-        else:
-            related = True
-            ahead = delta.ahead_by
-            behind = delta.behind_by
-        try:
-            pr = next(
-                iter(
-                    repo.parent.get_pulls(
-                        head=f"{repo.owner.login}:{br.name}",
-                        sort="created",
-                        direction="desc",
-                        state="all",
-                    )
-                )
-            )
-        except StopIteration:
-            prnum = None
-            prstatus = None
-        else:
-            prnum = pr.number
-            prstatus = "merged" if pr.merged_at is not None else pr.state
-        yield BranchStatus(
-            name=br.name,
-            on_parent=on_parent,
-            related=related,
-            ahead=ahead,
-            behind=behind,
-            prnum=prnum,
-            prstatus=prstatus,
+def get_branch_statuses(client: Client, fork: Fork) -> Iterator[BranchStatus]:
+    parent_heads = client.get_head_oids(fork.parent, [br.name for br in fork.branches])
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        yield from pool.map(
+            partial(get_branch_status, client, fork, parent_heads), fork.branches
         )
 
 
+def get_branch_status(
+    client: Client, fork: Fork, parent_heads: dict[str, str], br: Branch
+) -> BranchStatus:
+    if (parent_oid := parent_heads.get(br.name)) is not None:
+        on_parent = True
+        cmpbranch = br.name
+    else:
+        on_parent = False
+        cmpbranch = fork.default_branch
+        parent_oid = fork.default_oid
+    if br.oid == parent_oid:
+        # No need to ask the API to compare identical commits
+        related = True
+        ahead = 0
+        behind = 0
+    elif (
+        delta := client.compare(
+            fork.full_name, f"{fork.parent_owner}:{cmpbranch}", br.name
+        )
+    ) is not None:
+        related = True
+        ahead, behind = delta
+    else:
+        related = False
+        ahead = None
+        behind = None
+    return BranchStatus(
+        name=br.name,
+        on_parent=on_parent,
+        related=related,
+        ahead=ahead,
+        behind=behind,
+        prnum=br.prnum,
+        prstatus=br.prstatus,
+    )
+
+
 if __name__ == "__main__":
     main()
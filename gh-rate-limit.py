@@ -36,10 +36,14 @@ def main() -> None:
     with Client(token=get_ghtoken()) as client:
         data = client.get("/rate_limit")
         any_used = False
+        # Resets are at most an hour away, so the current UTC offset will do
+        # for all of them.  (Even if a DST change intervenes, the displayed
+        # timestamp still denotes the right instant.)
+        local_tz = datetime.now(timezone.utc).astimezone().tzinfo
         for k, v in data["resources"].items():
             if v["used"]:
                 any_used = True
-                reset = datetime.fromtimestamp(v["reset"], timezone.utc).astimezone()
+                reset = datetime.fromtimestamp(v["reset"], local_tz)
                 print(
                     f"{k}: {v['used']} / {v['limit']} used; {v['remaining']} left;"
                     f" reset at {reset}"
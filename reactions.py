@@ -1,65 +1,261 @@
 #!/usr/bin/env -S pipx run
 # /// script
 # requires-python = ">=3.9"
-# dependencies = ["ghreq ~= 0.1", "ghtoken ~= 0.1"]
+# dependencies = ["ghtoken ~= 0.1", "httpx[http2] ~= 0.27"]
 # ///
 
 from __future__ import annotations
 import argparse
-from collections.abc import Iterator
+import asyncio
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
 from enum import Enum
+import json
+from operator import itemgetter
 import textwrap
-import ghreq
+import time
+from types import TracebackType
+from typing import Any
 from ghtoken import get_ghtoken
+import httpx
 
 __author__ = "John Thorvald Wodder II"
 __author_email__ = "ghscripts@varonathe.org"
 __license__ = "MIT"
 __url__ = "https://github.com/jwodder/ghscripts"
 
+# Maximum number of times to retry a request that failed with a server error
+# or was rate limited
+RETRIES = 5
+
+# Base & maximum number of seconds to wait between retries of a request
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+
+SEARCH_QUERY = """
+query ($query: String!, $cursor: String) {
+    search (type: ISSUE, query: $query, first: 100, after: $cursor) {
+        nodes {
+            __typename
+            ... on Issue {
+                ...item
+            }
+            ... on PullRequest {
+                ...item
+            }
+        }
+        pageInfo {
+            endCursor
+            hasNextPage
+        }
+    }
+}
+
+fragment item on Reactable {
+    reactionGroups {
+        content
+        reactors {
+            totalCount
+        }
+    }
+    ... on RepositoryNode {
+        repository {
+            nameWithOwner
+            isFork
+        }
+    }
+    ... on Issue {
+        title
+        url
+        createdAt
+    }
+    ... on PullRequest {
+        title
+        url
+        createdAt
+    }
+}
+"""
+
 
 class Reaction(Enum):
-    THUMBS_DOWN = ("👎", "-1")
-    THUMBS_UP = ("👍", "+1")
-    LAUGH = ("😄", "laugh")
-    HOORAY = ("🎉", "hooray")
-    CONFUSED = ("😕", "confused")
-    HEART = ("❤️", "heart")
-    ROCKET = ("🚀", "rocket")
-    EYES = ("👀", "eyes")
-
-    def __new__(cls, value, shortcut):
-        obj = object.__new__(cls)
-        obj._value_ = value
-        obj.shortcut = shortcut
-        return obj
+    # The names of the members are the values that the GraphQL API uses for
+    # `ReactionContent`.
+    THUMBS_DOWN = "👎"
+    THUMBS_UP = "👍"
+    LAUGH = "😄"
+    HOORAY = "🎉"
+    CONFUSED = "😕"
+    HEART = "❤️"
+    ROCKET = "🚀"
+    EYES = "👀"
 
-    @classmethod
-    def from_shortcut(cls, shortcut: str) -> Reaction:
-        for r in Reaction:
-            if r.shortcut == shortcut:
-                return r
-        raise ValueError(shortcut)
-
-
-class Client(ghreq.Client):
-    def get_repositories(self) -> Iterator[str]:
-        for repo in self.paginate("/user/repos", params={"affiliation": "owner"}):
-            if not repo["archived"] and not repo["fork"]:
-                yield repo["full_name"]
-
-    def get_issue_reactions(self, repo: str) -> Iterator[Issue]:
-        for issue in self.paginate(f"/repos/{repo}/issues"):
-            yield Issue(
-                title=issue["title"],
-                url=issue["html_url"],
-                is_pr=issue.get("pull_request") is not None,
-                reactions={
-                    Reaction.from_shortcut(k): v
-                    for k, v in issue["reactions"].items()
-                    if k not in ("url", "total_count")
-                },
+
+class Client:
+    def __init__(self, token: str) -> None:
+        self.http = httpx.AsyncClient(
+            base_url="https://api.github.com",
+            headers={"Authorization": f"Bearer {token}"},
+            follow_redirects=True,
+            timeout=30.0,
+            transport=httpx.AsyncHTTPTransport(http2=True),
+        )
+
+    async def __aenter__(self) -> Client:
+        return self
+
+    async def __aexit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        await self.http.aclose()
+
+    async def query(self, query: str, variables: dict[str, Any]) -> dict:
+        req = self.http.build_request(
+            "POST", "/graphql", json={"query": query, "variables": variables}
+        )
+        r = await self.send(req)
+        data = r.json()
+        if err := data.get("errors"):
+            raise GraphQLException(err)
+        return data["data"]  # type: ignore[no-any-return]
+
+    async def send(self, req: httpx.Request) -> httpx.Response:
+        # Like ghreq, retry server errors, rate limits, and network errors with
+        # exponential backoff, and raise a PrettyHTTPError for any other 4xx or
+        # 5xx response
+        attempt = 0
+        while True:
+            try:
+                r = await self.http.send(req)
+            except httpx.TransportError:
+                if attempt >= RETRIES:
+                    raise
+                delay = backoff(attempt)
+            else:
+                d = retry_delay(r, attempt) if attempt < RETRIES else None
+                if d is None:
+                    if r.is_error:
+                        raise PrettyHTTPError(r)
+                    return r
+                delay = d
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def iter_reactions(self) -> AsyncIterator[Issue]:
+        # Yields the open issues & PRs with reactions in the non-fork,
+        # non-archived repositories owned by the authenticated user, grouped
+        # by repository
+        login = (await self.query("{ viewer { login } }", {}))["viewer"]["login"]
+        # Searching for `reactions:>0` means that issues without reactions
+        # (i.e., most of them) are never downloaded at all.
+        q = f"user:{login} is:open archived:false reactions:>0"
+        nodes: list[dict[str, Any]] = []
+        cursor = None
+        while True:
+            data = await self.query(SEARCH_QUERY, {"query": q, "cursor": cursor})
+            nodes.extend(
+                node
+                for node in data["search"]["nodes"]
+                # Issue searches have no qualifier for excluding forks
+                if not node["repository"]["isFork"]
+            )
+            page_info = data["search"]["pageInfo"]
+            if not page_info["hasNextPage"]:
+                break
+            cursor = page_info["endCursor"]
+        # List repositories in order and each one's issues & PRs newest first,
+        # like the REST API does
+        nodes.sort(key=itemgetter("createdAt"), reverse=True)
+        nodes.sort(key=lambda n: n["repository"]["nameWithOwner"].lower())
+        for node in nodes:
+            if (issue := Issue.from_node(node)) is not None:
+                yield issue
+
+
+class PrettyHTTPError(httpx.HTTPStatusError):
+    def __init__(self, response: httpx.Response) -> None:
+        super().__init__(
+            f"{response.status_code} error for URL: {response.url}",
+            request=response.request,
+            response=response,
+        )
+
+    def __str__(self) -> str:
+        r = self.response
+        kind = "Client" if r.is_client_error else "Server"
+        msg = f"{r.status_code} {kind} Error: {r.reason_phrase} for URL: {r.url}"
+        if r.text.strip():
+            try:
+                body = r.json()
+            except ValueError:
+                msg += "\n\n" + r.text
+            else:
+                msg += "\n\n" + json.dumps(body, indent=4)
+        return msg
+
+
+def backoff(attempt: int) -> float:
+    return float(min(BACKOFF_BASE * 2**attempt, BACKOFF_MAX))
+
+
+def retry_delay(r: httpx.Response, attempt: int) -> float | None:
+    # Returns how many seconds to wait before retrying the request that
+    # received `r`, or `None` if it should not be retried
+    if r.status_code >= 500:
+        return backoff(attempt)
+    elif r.status_code in (403, 429):
+        if (after := r.headers.get("Retry-After", "")).isdigit():
+            delay = int(after) + 1
+        elif (
+            r.headers.get("x-ratelimit-remaining") == "0"
+            and (reset := r.headers.get("x-ratelimit-reset", "")).isdigit()
+        ):
+            delay = int(reset) - int(time.time()) + 1
+        elif r.status_code == 429 or "rate limit" in r.text:
+            # Secondary rate limit without any indication of when it lifts
+            delay = 0
+        else:
+            # Plain "forbidden"
+            return None
+        if delay > BACKOFF_MAX:
+            # Not worth waiting for
+            return None
+        return max(delay, backoff(attempt))
+    else:
+        return None
+
+
+class GraphQLException(Exception):
+    def __init__(self, errors: list[dict[str, Any]]) -> None:
+        self.errors = errors
+        super().__init__(errors)
+
+    def __str__(self) -> str:
+        try:
+            lines = []
+            if len(self.errors) == 1:
+                lines.append("GraphQL API error:")
+            else:
+                lines.append("GraphQL API errors:")
+            first = True
+            for e in self.errors:
+                if first:
+                    first = False
+                else:
+                    lines.append("---")
+                for k, v in e.items():
+                    k = k.title()
+                    if isinstance(v, (str, int, bool)):
+                        lines.append(f"{k}: {v}")
+                    else:
+                        lines.append(k + ": " + json.dumps(v, sort_keys=True))
+            return "\n".join(lines)
+        except Exception:
+            return "MALFORMED GRAPHQL ERROR:\n" + json.dumps(
+                self.errors, sort_keys=True, indent=True
             )
 
 
@@ -68,17 +264,33 @@ class Issue:
     title: str
     url: str
     is_pr: bool
+    total_count: int
     reactions: dict[Reaction, int]
 
+    @classmethod
+    def from_node(cls, node: dict[str, Any]) -> Issue | None:
+        # Returns `None` if the issue has no reactions
+        counts = {
+            rg["content"]: rg["reactors"]["totalCount"] for rg in node["reactionGroups"]
+        }
+        # Build the dict in `Reaction` order so that `reaction_str()` can list
+        # the reactions in that order just by iterating over it
+        reactions = {r: qty for r in Reaction if (qty := counts.get(r.name, 0)) > 0}
+        if not reactions:
+            return None
+        return cls(
+            title=node["title"],
+            url=node["url"],
+            is_pr=node["__typename"] == "PullRequest",
+            total_count=sum(reactions.values()),
+            reactions=reactions,
+        )
+
     def has_reactions(self) -> bool:
-        return any(qty > 0 for qty in self.reactions.values())
+        return self.total_count > 0
 
     def reaction_str(self) -> str:
-        strs = []
-        for r in Reaction:
-            if (qty := self.reactions.get(r, 0)) > 0:
-                strs.append(f"{r.value} {qty}")
-        return " ".join(strs)
+        return " ".join(f"{r.value} {qty}" for r, qty in self.reactions.items())
 
 
 def main() -> None:
@@ -97,14 +309,17 @@ def main() -> None:
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.parse_args()
-    with Client(token=get_ghtoken()) as client:
-        for repo in client.get_repositories():
-            for issue in client.get_issue_reactions(repo):
-                if issue.has_reactions():
-                    print("Issue:" if not issue.is_pr else "PR:", issue.title)
-                    print("URL:", issue.url)
-                    print("Reactions:", issue.reaction_str())
-                    print()
+    asyncio.run(show_reactions(get_ghtoken()))
+
+
+async def show_reactions(token: str) -> None:
+    async with Client(token) as client:
+        async for issue in client.iter_reactions():
+            if issue.has_reactions():
+                print("Issue:" if not issue.is_pr else "PR:", issue.title)
+                print("URL:", issue.url)
+                print("Reactions:", issue.reaction_str())
+                print()
 
 
 if __name__ == "__main__":
@@ -6,11 +6,17 @@
 
 from __future__ import annotations
 import argparse
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
 import sys
 import textwrap
-import webbrowser
+from types import TracebackType
+from typing import Any
+from urllib.parse import urlencode
 import ghrepo
-from ghreq import Client
+import ghreq
 from ghtoken import get_ghtoken
 
 __author__ = "John Thorvald Wodder II"
@@ -18,6 +24,77 @@ __author_email__ = "ghscripts@varonathe.org"
 __license__ = "MIT"
 __url__ = "https://github.com/jwodder/ghscripts"
 
+# The responses from the last run are cached here along with their ETags so
+# that, when viewing the same branch's PR again, unchanged resources can be
+# fetched with conditional requests
+ETAG_CACHE = Path.home() / ".cache" / "ghscripts" / "viewpr-etags.json"
+
+
+class Client(ghreq.Client):
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.etags: dict[str, dict[str, Any]] = load_etags()
+        # Only the entries used in this run are saved, so that the cache
+        # doesn't accumulate an entry for every branch ever viewed
+        self.used_etags: dict[str, dict[str, Any]] = {}
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        super().__exit__(exc_type, exc_val, exc_tb)
+        # Don't let a failed run drop the entries that it didn't get to use
+        if exc_type is None and self.used_etags != self.etags:
+            save_etags(self.used_etags)
+
+    def get_page(
+        self, path: str, params: dict[str, Any] | None = None
+    ) -> tuple[Any, dict[str, str]]:
+        # Returns the decoded body and a mapping from Link header rels to
+        # URLs.  The request is conditional on the ETag of the resource from a
+        # previous run, and a 304 is served from the cache.
+        key = path + ("?" + urlencode(params) if params else "")
+        headers = {}
+        if (entry := self.etags.get(key)) is not None:
+            headers["If-None-Match"] = entry["etag"]
+        r = self.get(path, params=params, headers=headers, raw=True)
+        if r.status_code == 304 and entry is not None:
+            self.used_etags[key] = entry
+            return entry["body"], entry["links"]
+        data = r.json()
+        links = {rel: link["url"] for rel, link in r.links.items()}
+        if (etag := r.headers.get("ETag")) is not None:
+            self.used_etags[key] = {"etag": etag, "body": data, "links": links}
+        return data, links
+
+    def paginate_cached(
+        self, path: str, params: dict[str, Any] | None = None
+    ) -> Iterator[dict]:
+        url: str | None = path
+        while url is not None:
+            data, links = self.get_page(url, params)
+            yield from data
+            url = links.get("next")
+            params = None
+
+
+def load_etags() -> dict[str, dict[str, Any]]:
+    try:
+        with ETAG_CACHE.open(encoding="utf-8") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_etags(etags: dict[str, dict[str, Any]]) -> None:
+    # A partially-written file just fails to load next time, which only costs
+    # a cache miss.
+    ETAG_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    ETAG_CACHE.write_text(json.dumps(etags), encoding="utf-8")
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(
@@ -37,28 +114,38 @@ def main() -> None:
     parser.parse_args()
     local = ghrepo.get_local_repo()
     branch = ghrepo.get_current_branch()
-    with Client(token=get_ghtoken()) as client:
-        head = client.get(local.api_url)
+    params = {
+        "state": "all",
+        "head": f"{local.owner}:{branch}",
+        "sort": "created",
+        "direction": "desc",
+    }
+    with Client(token=get_ghtoken()) as client, ThreadPoolExecutor(1) as pool:
+        # The local repository is usually not a fork, in which case its PRs are
+        # listed under its own URL, so look them up while the repository
+        # itself is being fetched.
+        speculative = pool.submit(get_latest_pr, client, local.api_url, params)
+        head, _ = client.get_page(local.api_url)
         if head["fork"]:
             base = head["parent"]
+            pr = get_latest_pr(client, base["url"], params)
         else:
             base = head
-        pulls = client.paginate(
-            f"{base['url']}/pulls",
-            params={
-                "state": "all",
-                "head": f"{local.owner}:{branch}",
-                "sort": "created",
-                "direction": "desc",
-            },
+            pr = speculative.result()
+    if pr is not None:
+        # webbrowser is slow to import, so only do so when it's needed
+        import webbrowser
+
+        webbrowser.open(pr["html_url"])
+    else:
+        sys.exit(
+            f"No pull request found for {branch!r} in {base['full_name']}"
+            f" from {local}"
         )
-        if (pr := next(pulls, None)) is not None:
-            webbrowser.open(pr["html_url"])
-        else:
-            sys.exit(
-                f"No pull request found for {branch!r} in {base['full_name']}"
-                f" from {local}"
-            )
+
+
+def get_latest_pr(client: Client, repo_url: str, params: dict[str, Any]) -> Any:
+    return next(client.paginate_cached(f"{repo_url}/pulls", params=params), None)
 
 
 if __name__ == "__main__":